@@ -9,14 +9,17 @@ img = cv2.imread(depth_file, cv2.IMREAD_ANYDEPTH)
 print("深度图信息:")
 print(f"数据类型: {img.dtype}")
 print(f"形状: {img.shape}")
-print(f"最小值: {img.min()}")
-print(f"最大值: {img.max()}")
-print(f"平均值: {img.mean():.2f}")
-print(f"标准差: {img.std():.2f}")
+# 最值、均值和标准差各由OpenCV一次遍历得到
+min_val, max_val, _, _ = cv2.minMaxLoc(img)
+mean, std = cv2.meanStdDev(img)
+print(f"最小值: {int(min_val)}")
+print(f"最大值: {int(max_val)}")
+print(f"平均值: {mean[0, 0]:.2f}")
+print(f"标准差: {std[0, 0]:.2f}")
 
-# 显示前10个像素值
+# 显示前10个像素值（ravel返回视图，不复制整幅图像）
 print("前10个像素值:")
-print(img.flatten()[:10])
+print(img.ravel()[:10])
 
 # 分析非零像素
 nonzero_pixels = img[img > 0]
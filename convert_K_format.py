@@ -2,11 +2,18 @@
 #python convert_K_format.py "dataset/promptda" -d -t csv
 
 import os
+import sys
 import argparse
 import csv
 import numpy as np
+import pandas as pd
 from pathlib import Path
 
+try:
+    import pyarrow.csv as pacsv
+except ImportError:  # 未安装pyarrow时使用pandas的C解析器
+    pacsv = None
+
 
 def read_csv_matrix(csv_path):
     """
@@ -88,25 +95,14 @@ def convert_matrix_to_K_format(matrix, output_path):
     if not matrix:
         return False
     
-    # 转换为科学计数法格式
-    converted_lines = []
-    for row in matrix:
-        formatted_row = []
-        for value in row:
-            # 转换为科学计数法，保持精度
-            formatted_value = f"{value:.16e}"
-            formatted_row.append(formatted_value)
-        converted_lines.append(" ".join(formatted_row) + "\n")
-    
-    # 写入转换后的文件
+    # 转换为科学计数法格式并写入文件，保持精度
+    matrix = np.asarray(matrix, dtype=np.float64)
     try:
-        with open(output_path, 'w') as f:
-            f.writelines(converted_lines)
+        np.savetxt(output_path, matrix, fmt='%.16e', delimiter=' ')
         
         print(f"✅ 转换完成: -> {output_path}")
         print("转换后的格式:")
-        for line in converted_lines:
-            print(f"  {line.strip()}")
+        np.savetxt(sys.stdout, matrix, fmt='  %.16e %.16e %.16e')
         return True
     except Exception as e:
         print(f"❌ 写入文件失败: {e}")
@@ -149,30 +145,58 @@ def convert_csv_to_K(input_path, output_path):
     return convert_matrix_to_K_format(matrix, output_path)
 
 
-def quaternion_to_rotation_matrix(qx, qy, qz, qw):
+def quaternion_to_rotation_matrix_batch(q):
     """
-    将四元数转换为旋转矩阵
+    批量将四元数转换为旋转矩阵
     
     Args:
-        qx, qy, qz, qw: 四元数分量
+        q: (N, 4) 四元数数组，每行为 qx, qy, qz, qw
         
     Returns:
-        3x3旋转矩阵
+        (N, 3, 3) 旋转矩阵数组
     """
     # 归一化四元数
-    norm = np.sqrt(qx*qx + qy*qy + qz*qz + qw*qw)
-    qx, qy, qz, qw = qx/norm, qy/norm, qz/norm, qw/norm
+    q = np.asarray(q, dtype=np.float64)
+    q = q / np.linalg.norm(q, axis=1, keepdims=True)
+    qx, qy, qz, qw = q.T
     
     # 计算旋转矩阵
-    R = np.array([
-        [1-2*qy*qy-2*qz*qz, 2*qx*qy-2*qz*qw, 2*qx*qz+2*qy*qw],
-        [2*qx*qy+2*qz*qw, 1-2*qx*qx-2*qz*qz, 2*qy*qz-2*qx*qw],
-        [2*qx*qz-2*qy*qw, 2*qy*qz+2*qx*qw, 1-2*qx*qx-2*qy*qy]
-    ])
+    R = np.empty((len(q), 3, 3))
+    R[:, 0, 0] = 1-2*qy*qy-2*qz*qz
+    R[:, 0, 1] = 2*qx*qy-2*qz*qw
+    R[:, 0, 2] = 2*qx*qz+2*qy*qw
+    R[:, 1, 0] = 2*qx*qy+2*qz*qw
+    R[:, 1, 1] = 1-2*qx*qx-2*qz*qz
+    R[:, 1, 2] = 2*qy*qz-2*qx*qw
+    R[:, 2, 0] = 2*qx*qz-2*qy*qw
+    R[:, 2, 1] = 2*qy*qz+2*qx*qw
+    R[:, 2, 2] = 1-2*qx*qx-2*qy*qy
     
     return R
 
 
+def read_odometry_csv(input_path, columns):
+    """
+    读取odometry.csv中指定的列，优先使用pyarrow的多线程CSV解析器
+    
+    Args:
+        input_path: 输入odometry.csv文件路径
+        columns: 需要读取的列名（不含空格）
+        
+    Returns:
+        DataFrame: 只包含columns中存在于文件里的列，列名已去除空格
+    """
+    if pacsv is not None:
+        tbl = pacsv.read_csv(input_path)
+        # 清理列名（去除空格）
+        tbl = tbl.rename_columns([col.strip() for col in tbl.column_names])
+        return tbl.select([col for col in tbl.column_names if col in columns]).to_pandas()
+    
+    # skipinitialspace会同时去掉列名和数值前的空格
+    return pd.read_csv(input_path, engine='c', skipinitialspace=True,
+                       usecols=lambda col: col in columns)
+
+
 def convert_odometry_to_poses(input_path, output_path, frame_skip=1):
     """
     将odometry.csv文件转换为poses.txt格式，支持抽帧
@@ -182,85 +206,41 @@ def convert_odometry_to_poses(input_path, output_path, frame_skip=1):
         output_path: 输出poses.txt文件路径
         frame_skip: 抽帧比例，每隔frame_skip个位姿选择1个（默认1表示不抽帧）
     """
-    poses = []
-    all_poses = []  # 存储所有位姿，用于抽帧
-    
     try:
-        with open(input_path, 'r', newline='', encoding='utf-8') as f:
-            reader = csv.DictReader(f)
-            
-            # 检查列名
-            fieldnames = reader.fieldnames
-            print(f"📋 检测到的列名: {fieldnames}")
-            
-            # 清理列名（去除空格）
-            cleaned_fieldnames = [col.strip() if col else col for col in fieldnames]
-            print(f"🧹 清理后的列名: {cleaned_fieldnames}")
-            
-            # 验证必需的列是否存在（考虑可能的空格）
-            required_columns = ['x', 'y', 'z', 'qx', 'qy', 'qz', 'qw']
-            missing_columns = []
-            
-            # 检查原始列名和清理后的列名
-            for col in required_columns:
-                if col not in fieldnames and col not in cleaned_fieldnames:
-                    missing_columns.append(col)
-            
-            if missing_columns:
-                print(f"❌ 缺少必需的列: {missing_columns}")
-                return False
-            
-            for row in reader:
-                try:
-                    # 尝试从原始列名或清理后的列名获取数据
-                    def get_value(row, col_name):
-                        # 尝试原始列名
-                        if col_name in row:
-                            return row[col_name]
-                        # 尝试带空格的列名
-                        spaced_col = f" {col_name}"
-                        if spaced_col in row:
-                            return row[spaced_col]
-                        raise KeyError(f"找不到列: {col_name}")
-                    
-                    # 提取位置和四元数
-                    x = float(get_value(row, 'x').strip() if isinstance(get_value(row, 'x'), str) else get_value(row, 'x'))
-                    y = float(get_value(row, 'y').strip() if isinstance(get_value(row, 'y'), str) else get_value(row, 'y'))
-                    z = float(get_value(row, 'z').strip() if isinstance(get_value(row, 'z'), str) else get_value(row, 'z'))
-                    qx = float(get_value(row, 'qx').strip() if isinstance(get_value(row, 'qx'), str) else get_value(row, 'qx'))
-                    qy = float(get_value(row, 'qy').strip() if isinstance(get_value(row, 'qy'), str) else get_value(row, 'qy'))
-                    qz = float(get_value(row, 'qz').strip() if isinstance(get_value(row, 'qz'), str) else get_value(row, 'qz'))
-                    qw = float(get_value(row, 'qw').strip() if isinstance(get_value(row, 'qw'), str) else get_value(row, 'qw'))
-                    
-                    # 转换为旋转矩阵
-                    R = quaternion_to_rotation_matrix(qx, qy, qz, qw)
-                    
-                    # 构建4x4变换矩阵
-                    pose = np.eye(4)
-                    pose[:3, :3] = R
-                    pose[:3, 3] = [x, y, z]
-                    
-                    # 展平为一行
-                    pose_flat = pose.flatten()
-                    all_poses.append(pose_flat)
-                    
-                except (ValueError, KeyError) as e:
-                    print(f"⚠️  跳过无效行: {e}")
-                    continue
+        # 只读取需要的列
+        required_columns = ['x', 'y', 'z', 'qx', 'qy', 'qz', 'qw']
+        df = read_odometry_csv(input_path, required_columns)
+        
+        # 验证必需的列是否存在
+        missing_columns = [col for col in required_columns if col not in df.columns]
+        
+        if missing_columns:
+            print(f"❌ 缺少必需的列: {missing_columns}")
+            return False
+        
+        # 无法解析为数字的行视为无效行
+        values = df[required_columns].apply(pd.to_numeric, errors='coerce')
+        invalid = values.isna().any(axis=1)
+        if invalid.any():
+            print(f"⚠️  跳过 {int(invalid.sum())} 个无效行")
+            values = values[~invalid]
+        values = values.to_numpy(dtype=np.float64)
         
         # 抽帧处理
         if frame_skip > 1:
-            poses = all_poses[::frame_skip]  # 每隔frame_skip个选择1个
-            print(f"🔄 抽帧处理: 从 {len(all_poses)} 个位姿中每隔 {frame_skip} 个选择1个，共选择 {len(poses)} 个位姿")
+            selected = values[::frame_skip]  # 每隔frame_skip个选择1个
+            print(f"🔄 抽帧处理: 从 {len(values)} 个位姿中每隔 {frame_skip} 个选择1个，共选择 {len(selected)} 个位姿")
         else:
-            poses = all_poses
+            selected = values
+        
+        # 批量构建4x4变换矩阵
+        poses = np.zeros((len(selected), 4, 4))
+        poses[:, :3, :3] = quaternion_to_rotation_matrix_batch(selected[:, 3:7])
+        poses[:, :3, 3] = selected[:, :3]
+        poses[:, 3, 3] = 1
         
-        # 写入poses.txt文件
-        with open(output_path, 'w') as f:
-            for pose in poses:
-                # 转换为科学计数法格式
-                pose_str = " ".join([f"{val:.16e}" for val in pose])
-                f.write(pose_str + "\n")
+        # 写入poses.txt文件，每个位姿展平为一行
+        np.savetxt(output_path, poses.reshape(len(poses), 16), fmt='%.16e')
         
         print(f"✅ 转换完成: {input_path} -> {output_path}")
         print(f"📊 转换了 {len(poses)} 个位姿")
@@ -289,39 +269,33 @@ def convert_directory(input_dir, output_dir=None, file_type="txt", frame_skip=1)
     
     # 智能识别文件类型
     if file_type == "csv":
-        # 分别处理camera_matrix.csv和odometry.csv
-        camera_files = list(input_path.rglob("camera_matrix.csv"))
-        odometry_files = list(input_path.rglob("odometry.csv"))
+        # 分别处理camera_matrix.csv（内参）和odometry.csv（外参），按文件名分发到对应的转换函数
+        converters = {
+            "camera_matrix.csv": ("K.txt", convert_csv_to_K),
+            "odometry.csv": ("poses.txt", lambda src, dst: convert_odometry_to_poses(src, dst, frame_skip)),
+        }
         
-        print(f"📁 找到 {len(camera_files)} 个camera_matrix.csv文件:")
-        for file in camera_files:
-            print(f"  - {file}")
-        
-        print(f"📁 找到 {len(odometry_files)} 个odometry.csv文件:")
-        for file in odometry_files:
-            print(f"  - {file}")
+        # 只遍历一次目录树
+        found_files = {name: [] for name in converters}
+        for file in input_path.rglob("*.csv"):
+            if file.name in found_files:
+                found_files[file.name].append(file)
         
-        # 转换camera_matrix.csv文件（内参）
-        for file in camera_files:
-            if output_dir:
-                rel_path = file.relative_to(input_path)
-                output_file = Path(output_dir) / rel_path.parent / "K.txt"
-                output_file.parent.mkdir(parents=True, exist_ok=True)
-                convert_csv_to_K(str(file), str(output_file))
-            else:
-                output_file = file.parent / "K.txt"
-                convert_csv_to_K(str(file), str(output_file))
+        for name, files in found_files.items():
+            print(f"📁 找到 {len(files)} 个{name}文件:")
+            for file in files:
+                print(f"  - {file}")
         
-        # 转换odometry.csv文件（外参）
-        for file in odometry_files:
-            if output_dir:
-                rel_path = file.relative_to(input_path)
-                output_file = Path(output_dir) / rel_path.parent / "poses.txt"
-                output_file.parent.mkdir(parents=True, exist_ok=True)
-                convert_odometry_to_poses(str(file), str(output_file), frame_skip)
-            else:
-                output_file = file.parent / "poses.txt"
-                convert_odometry_to_poses(str(file), str(output_file), frame_skip)
+        for name, files in found_files.items():
+            output_name, convert = converters[name]
+            for file in files:
+                if output_dir:
+                    rel_path = file.relative_to(input_path)
+                    output_file = Path(output_dir) / rel_path.parent / output_name
+                    output_file.parent.mkdir(parents=True, exist_ok=True)
+                else:
+                    output_file = file.parent / output_name
+                convert(str(file), str(output_file))
                 
     elif file_type == "odometry":
         # 只处理odometry.csv文件
@@ -413,7 +387,6 @@ def main():
 
 if __name__ == "__main__":
     # 如果没有命令行参数，提供交互式界面
-    import sys
     if len(sys.argv) == 1:
         print("🔧 相机内参矩阵格式转换工具")
         print("=" * 50)
@@ -1,30 +1,97 @@
 import os
+import concurrent.futures
+import functools
 import numpy as np
 import cv2
 from pathlib import Path
 from tqdm import tqdm
 
+try:
+    import numba
+    from numba import njit, prange
+except ImportError:  # 未安装numba时退回到纯NumPy实现
+    numba = None
+    njit = None
 
-def write_point_cloud(ply_filename, points):
-    formatted_points = []
-    for point in points:
-        formatted_points.append("%f %f %f %d %d %d 0\n" % (point[0], point[1], point[2], point[3], point[4], point[5]))
-
-    out_file = open(ply_filename, "w")
-    out_file.write('''ply
-    format ascii 1.0
-    element vertex %d
-    property float x
-    property float y
-    property float z
-    property uchar blue
-    property uchar green
-    property uchar red
-    property uchar alpha
-    end_header
-    %s
-    ''' % (len(points), "".join(formatted_points)))
-    out_file.close()
+
+# PLY顶点的内存布局，与PLY_HEADER中声明的属性一一对应
+PLY_VERTEX_DTYPE = np.dtype([('x', '<f4'), ('y', '<f4'), ('z', '<f4'),
+                             ('b', 'u1'), ('g', 'u1'), ('r', 'u1'), ('a', 'u1')])
+
+# header每行必须顶格书写，否则不符合ply规范
+PLY_HEADER = ("ply\n"
+              "format %s 1.0\n"
+              "element vertex %d\n"
+              "property float x\n"
+              "property float y\n"
+              "property float z\n"
+              "property uchar blue\n"
+              "property uchar green\n"
+              "property uchar red\n"
+              "property uchar alpha\n"
+              "end_header\n")
+
+
+def write_point_cloud(ply_filename, points, binary=True):
+    """
+    将点云保存为ply文件
+    Args:
+        ply_filename: 输出ply文件路径
+        points: dtype为PLY_VERTEX_DTYPE的结构化数组
+        binary: 为True时保存为binary_little_endian格式，否则保存为ascii格式（便于只支持文本ply的下游工具）
+    """
+    points = np.ascontiguousarray(points, dtype=PLY_VERTEX_DTYPE)
+    with open(ply_filename, "wb") as out_file:
+        if binary:
+            # header之后直接把连续的顶点缓冲区整块写入文件，不生成中间字符串
+            out_file.write((PLY_HEADER % ("binary_little_endian", len(points))).encode("ascii"))
+            points.tofile(out_file)
+        else:
+            # 逐行直接写入文件，不拼接整个文件内容的大字符串
+            out_file.write((PLY_HEADER % ("ascii", len(points))).encode("ascii"))
+            np.savetxt(out_file, points, fmt="%f %f %f %d %d %d %d")
+
+
+if njit is not None:
+    @njit(parallel=True, cache=True)
+    def _count_valid_per_row(depth):
+        counts = np.zeros(depth.shape[0], dtype=np.int64)
+        for v in prange(depth.shape[0]):
+            c = 0
+            for u in range(depth.shape[1]):
+                if depth[v, u] > 0:
+                    c += 1
+            counts[v] = c
+        return counts
+
+    @njit(parallel=True, fastmath=True, cache=True)
+    def _unproject(depth, rgb, inv_fx, inv_fy, cx, cy, inv_scale, P, row_offsets, out):
+        """
+        单次遍历深度图完成反投影、位姿变换和颜色采样，结果直接写入out
+        Args:
+            P: 相机位姿的前三行 (3x4)
+            row_offsets: 每一行第一个有效像素在out中的下标
+            out: dtype为PLY_VERTEX_DTYPE的结构化数组
+        """
+        for v in prange(depth.shape[0]):
+            idx = row_offsets[v]
+            for u in range(depth.shape[1]):
+                if depth[v, u] <= 0:
+                    continue
+                z = np.float32(depth[v, u]) * inv_scale
+                x = (np.float32(u) - cx) * z * inv_fx
+                y = (np.float32(v) - cy) * z * inv_fy
+
+                out[idx].x = P[0, 0] * x + P[0, 1] * y + P[0, 2] * z + P[0, 3]
+                out[idx].y = P[1, 0] * x + P[1, 1] * y + P[1, 2] * z + P[1, 3]
+                out[idx].z = P[2, 0] * x + P[2, 1] * y + P[2, 2] * z + P[2, 3]
+                out[idx].b = rgb[v, u, 0]
+                out[idx].g = rgb[v, u, 1]
+                out[idx].r = rgb[v, u, 2]
+                out[idx].a = 0
+                idx += 1
+else:
+    _unproject = None
 
 
 def adjust_intrinsics_for_resolution(K_original, original_size, target_size):
@@ -49,99 +116,138 @@ def adjust_intrinsics_for_resolution(K_original, original_size, target_size):
     return K_adjusted
 
 
-def depth_image_to_point_cloud(rgb, depth, scale, K, pose, rgb_size=None):
+def depth_image_to_point_cloud(rgb, depth, scale, K, pose=None):
     """
     将深度图转换为点云
     Args:
-        rgb: RGB图像
+        rgb: RGB图像，分辨率需与深度图一致
         depth: 深度图
         scale: 深度尺度因子
-        K: 内参矩阵
-        pose: 相机位姿矩阵
-        rgb_size: RGB图像的原始尺寸 (height, width)，用于调整内参
+        K: 与深度图分辨率对应的内参矩阵
+        pose: 相机位姿矩阵 (4x4或3x4)，为None时点云保留在当前帧的相机坐标系下
+    Returns:
+        points: dtype为PLY_VERTEX_DTYPE的结构化数组
     """
-    # 如果提供了RGB原始尺寸，调整内参矩阵以匹配深度图分辨率
-    if rgb_size is not None and rgb.shape[:2] != depth.shape[:2]:
-        K_adjusted = adjust_intrinsics_for_resolution(K, rgb_size, depth.shape[:2])
-        print(f"调整内参矩阵以匹配深度图分辨率: {depth.shape[:2]}")
-        K = K_adjusted
-        
-        # 调整RGB图像尺寸以匹配深度图
-        rgb = cv2.resize(rgb, (depth.shape[1], depth.shape[0]), interpolation=cv2.INTER_LINEAR)
-        print(f"调整RGB图像尺寸以匹配深度图: {rgb.shape[:2]}")
-    
-    # 使用深度图分辨率进行反投影
-    u = range(0, depth.shape[1])
-    v = range(0, depth.shape[0])
+    # 使用深度图分辨率进行反投影，只对有效深度的像素计算，全程使用float32
+    inv_fx = np.float32(1.0 / K[0, 0])
+    inv_fy = np.float32(1.0 / K[1, 1])
+    cx = np.float32(K[0, 2])
+    cy = np.float32(K[1, 2])
+
+    if _unproject is not None:
+        # 先统计每行有效像素数得到写入偏移，再并行填充输出
+        counts = _count_valid_per_row(depth)
+        row_offsets = np.zeros_like(counts)
+        np.cumsum(counts[:-1], out=row_offsets[1:])
+        points = np.empty(int(counts.sum()), dtype=PLY_VERTEX_DTYPE)
+        P = np.eye(3, 4, dtype=np.float32) if pose is None else np.ascontiguousarray(pose[:3, :4], dtype=np.float32)
+        _unproject(depth, rgb, inv_fx, inv_fy, cx, cy, np.float32(1.0 / scale), P, row_offsets, points)
+        return points
 
-    u, v = np.meshgrid(u, v)
-    u = u.astype(float)
-    v = v.astype(float)
+    # 深度不大于0的像素无效，只取一次有效像素的行列下标，后续都用这组下标采样
+    vs, us = np.nonzero(depth > 0)
 
-    Z = depth.astype(float) / scale
-    X = (u - K[0, 2]) * Z / K[0, 0]
-    Y = (v - K[1, 2]) * Z / K[1, 1]
+    Z = depth[vs, us].astype(np.float32) / np.float32(scale)
+    X = (us.astype(np.float32) - cx) * Z * inv_fx
+    Y = (vs.astype(np.float32) - cy) * Z * inv_fy
 
-    X = np.ravel(X)
-    Y = np.ravel(Y)
-    Z = np.ravel(Z)
+    if pose is None:
+        position = (X, Y, Z)
+    else:
+        # 只使用位姿的旋转和平移部分，平移通过广播加到每一列
+        position = pose[:3, :3].astype(np.float32) @ np.stack((X, Y, Z)) + pose[:3, 3:4].astype(np.float32)
+
+    # OpenCV读取的是BGR格式，与ply header中blue/green/red的顺序一致
+    bgr = rgb[vs, us]
+
+    points = np.empty(len(Z), dtype=PLY_VERTEX_DTYPE)
+    points['x'] = position[0]
+    points['y'] = position[1]
+    points['z'] = position[2]
+    points['b'] = bgr[:, 0]
+    points['g'] = bgr[:, 1]
+    points['r'] = bgr[:, 2]
+    points['a'] = 0
+
+    return points
 
-    valid = Z > 0
 
-    X = X[valid]
-    Y = Y[valid]
-    Z = Z[valid]
+def _read_image(image_path, flags=cv2.IMREAD_COLOR):
+    """
+    先整块读取文件字节再用cv2.imdecode解码，读取和解码期间都不持有GIL，且支持非ASCII路径
+    """
+    return cv2.imdecode(np.fromfile(str(image_path), dtype=np.uint8), flags)
 
-    position = np.vstack((X, Y, Z, np.ones(len(X))))
-    position = np.dot(pose, position)
 
-    # OpenCV读取的是BGR格式，需要转换为RGB
-    B = np.ravel(rgb[:, :, 0])[valid]
-    G = np.ravel(rgb[:, :, 1])[valid]
-    R = np.ravel(rgb[:, :, 2])[valid]
+def _init_worker():
+    # 并行粒度已经是帧，每个进程内的numba内核只用单线程，避免线程数超额
+    if numba is not None:
+        numba.set_num_threads(1)
 
-    points = np.transpose(np.vstack((position[0:3, :], R, G, B))).tolist()
 
-    return points
+def _process_frame(image_file, depth_file, pose, K, scale, save_ply_path, binary_ply):
+    """
+    处理单帧：读取RGB和深度图，反投影为点云并保存为ply文件
+    """
+    rgb = _read_image(image_file)
+    depth = _read_image(depth_file, cv2.IMREAD_UNCHANGED)
+
+    # 调整RGB图像尺寸以匹配深度图
+    if rgb.shape[:2] != depth.shape[:2]:
+        rgb = cv2.resize(rgb, (depth.shape[1], depth.shape[0]), interpolation=cv2.INTER_LINEAR)
+
+    current_points_3D = depth_image_to_point_cloud(rgb, depth, scale=scale, K=K, pose=pose)
+    save_ply_name = os.path.basename(os.path.splitext(image_file)[0]) + ".ply"
+    write_point_cloud(os.path.join(save_ply_path, save_ply_name), current_points_3D, binary=binary_ply)
 
 
 # image_files: XXXXXX.png (RGB, 24-bit, PNG)
 # depth_files: XXXXXX.png (16-bit, PNG)
 # poses: camera-to-world, 4×4 matrix in homogeneous coordinates
-def build_point_cloud(dataset_path, scale, view_ply_in_world_coordinate):
-    K = np.fromfile(os.path.join(dataset_path, "K.txt"), dtype=float, sep="\n ")
-    K = np.reshape(K, (3, 3))
+def build_point_cloud(dataset_path, scale, view_ply_in_world_coordinate, binary_ply=True):
+    K = np.loadtxt(os.path.join(dataset_path, "K.txt")).reshape(3, 3)
     image_files = sorted(Path(os.path.join(dataset_path, "images")).glob('*.png'))
     depth_files = sorted(Path(os.path.join(dataset_path, "depth_maps")).glob('*.png'))
 
     if view_ply_in_world_coordinate:
-        poses = np.fromfile(os.path.join(dataset_path, "poses.txt"), dtype=float, sep="\n ")
-        poses = np.reshape(poses, (-1, 4, 4))
+        # 只保留每个位姿的前三行 (3x4)，并转换为连续的float32数组，每帧直接取视图，无需再复制或转换类型
+        poses = np.loadtxt(os.path.join(dataset_path, "poses.txt")).reshape(-1, 4, 4)
+        poses = np.ascontiguousarray(poses[:, :3], dtype=np.float32)
     else:
-        poses = np.eye(4)
+        poses = [None] * len(image_files)
+
+    # 每张RGB图像都需要对应的深度图和位姿，数量不足时报错，否则并行处理时会静默丢帧；多余的部分忽略
+    if len(depth_files) < len(image_files):
+        raise ValueError(f"深度图数量({len(depth_files)})少于RGB图像数量({len(image_files)})")
+    if len(poses) < len(image_files):
+        raise ValueError(f"位姿数量({len(poses)})少于RGB图像数量({len(image_files)})")
+    depth_files = depth_files[:len(image_files)]
+    poses = poses[:len(image_files)]
 
     # 获取RGB图像的原始尺寸（用于调整内参矩阵）
-    first_rgb = cv2.imread(str(image_files[0]))
+    first_rgb = _read_image(image_files[0])
     rgb_original_size = first_rgb.shape[:2]  # (height, width)
     print(f"RGB图像原始尺寸: {rgb_original_size}")
-    
-    for i in tqdm(range(0, len(image_files))):
-        image_file = image_files[i]
-        depth_file = depth_files[i]
 
-        rgb = cv2.imread(image_file)
-        depth = cv2.imread(depth_file, -1).astype(np.uint16)
+    # 所有帧的分辨率相同，内参矩阵只需按深度图分辨率调整一次
+    # 深度图应为16位PNG，只检查第一帧，逐帧读取时不再做类型转换
+    first_depth = _read_image(depth_files[0], cv2.IMREAD_UNCHANGED)
+    if first_depth.dtype != np.uint16:
+        raise ValueError(f"深度图应为16位PNG，当前数据类型: {first_depth.dtype}")
+    depth_size = first_depth.shape[:2]
+    if rgb_original_size != depth_size:
+        K = adjust_intrinsics_for_resolution(K, rgb_original_size, depth_size)
+        print(f"调整内参矩阵以匹配深度图分辨率: {depth_size}")
 
-        if view_ply_in_world_coordinate:
-            current_points_3D = depth_image_to_point_cloud(rgb, depth, scale=scale, K=K, pose=poses[i], rgb_size=rgb_original_size)
-        else:
-            current_points_3D = depth_image_to_point_cloud(rgb, depth, scale=scale, K=K, pose=poses, rgb_size=rgb_original_size)
-        save_ply_name = os.path.basename(os.path.splitext(image_files[i])[0]) + ".ply"
-        save_ply_path = os.path.join(dataset_path, "point_clouds")
+    save_ply_path = os.path.join(dataset_path, "point_clouds")
+    Path(save_ply_path).mkdir(parents=True, exist_ok=True)  # 文件夹不存在时创建（包括上级目录）
 
-        if not os.path.exists(save_ply_path):  # 判断是否存在文件夹如果不存在则创建为文件夹
-            os.mkdir(save_ply_path)
-        write_point_cloud(os.path.join(save_ply_path, save_ply_name), current_points_3D)
+    # 每一帧相互独立，按帧分配到多个进程并行处理
+    process_frame = functools.partial(_process_frame, K=K, scale=scale, save_ply_path=save_ply_path,
+                                      binary_ply=binary_ply)
+    with concurrent.futures.ProcessPoolExecutor(max_workers=os.cpu_count(), initializer=_init_worker) as executor:
+        for _ in tqdm(executor.map(process_frame, image_files, depth_files, poses), total=len(image_files)):
+            pass
 
 
 if __name__ == '__main__':
@@ -152,4 +258,6 @@ if __name__ == '__main__':
     # 深度图对应的尺度因子，即深度图中存储的值与真实深度（单位为m）的比例, depth_map_value / real depth = scale_factor
     # 不同数据集对应的尺度因子不同，比如TUM的scale_factor为5000， hololens的数据的scale_factor为1000, Apollo Scape数据的scale_factor为200
     scale_factor = 1000.0  # Stray Scanner: 毫米转米
-    build_point_cloud(os.path.join(dataset_folder, scene), scale_factor, view_ply_in_world_coordinate)
+    # 为True时保存为binary ply（体积小、写入快），为False时保存为ascii ply
+    binary_ply = True
+    build_point_cloud(os.path.join(dataset_folder, scene), scale_factor, view_ply_in_world_coordinate, binary_ply)